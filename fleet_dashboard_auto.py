@@ -7,8 +7,15 @@ Combined Samsara + Excel Data with Comprehensive Visualizations
 import streamlit as st
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import contextlib
+import hashlib
 import io
 import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 import plotly.express as px
@@ -22,7 +29,43 @@ load_dotenv()
 # Configuration
 SAMSARA_API_TOKEN = os.getenv('SAMSARA_API_TOKEN', '')
 SAMSARA_BASE_URL = 'https://api.samsara.com'
+SAMSARA_PAGE_LIMIT = 512  # Maximum page size for /fleet/vehicles/stats
 EXCEL_URL = 'https://docs.google.com/spreadsheets/d/1QuHCNW8lJ5p6uYx1cvAP70u41l0KIjepxGIgZMr_xeg/export?format=csv&gid=1266601948'
+EXCEL_CACHE_DIR = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'fleet_dashboard')  # Per-user sheet snapshots, survive restarts
+EXCEL_CACHE_TTL = 3600  # Oldest sheet data the dashboard may show
+FLEET_CACHE_TTL = 300  # Combined fleet data, refreshed with the Samsara stats
+
+# Sheet data passes through three caches (disk snapshot, in-memory sheet,
+# combined fleet data), so their ages add up; the two sheet layers share
+# what is left of EXCEL_CACHE_TTL after the combined cache
+EXCEL_LAYER_TTL = (EXCEL_CACHE_TTL - FLEET_CACHE_TTL) // 2
+
+# Nested Samsara fields used by the dashboard, as flattened by pd.json_normalize
+SAMSARA_FIELDS = [
+    'id', 'name', 'externalIds.samsara.vin', 'externalIds.samsara.serial',
+    'obdOdometerMeters.value', 'obdOdometerMeters.time',
+    'gpsDistanceMeters.value', 'gpsDistanceMeters.time'
+]
+
+# Markers in the sheet's first column for units that are no longer in service
+EXCEL_JUNK_ENTRIES = ['OLD', 'DKD', 'GNS', 'SOLD']
+
+# Excel fields carried into the combined view (canonical column names)
+EXCEL_FIELDS = ['Status', 'Annual_Date', 'PM_Date', 'PM_Insp_Date']
+
+# Accepted Excel date formats, tried in order
+DATE_FORMATS = ['%m/%d/%Y', '%Y-%m-%d', '%d.%m.%Y', '%m-%d-%Y']
+
+# Alert statuses, most urgent first; alert columns are ordered categoricals over these
+ALERT_LEVELS = ['OVERDUE', 'CRITICAL', 'WARNING', 'OK', 'No Data']
+
+COMBINED_COLUMNS = [
+    'Vehicle_ID', 'Vehicle_Name', 'VIN', 'Serial',
+    'OBD_Odometer_Miles', 'GPS_Distance_Miles', 'OBD_Last_Update', 'GPS_Last_Update',
+    'Status', 'Annual_Date', 'Annual_Days_Remaining',
+    'PM_Date', 'PM_Days_Remaining', 'PM_Insp_Date', 'PM_Insp_Days_Remaining',
+    'Annual_Alert', 'PM_Alert', 'PM_Insp_Alert'
+]
 
 st.set_page_config(
     page_title="🚛 Fleet Management Dashboard", 
@@ -30,52 +73,165 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-def get_samsara_stats():
+@st.cache_resource
+def get_session():
+    """Creates the shared HTTP session, kept across Streamlit reruns"""
+    # Keep-alive connection pool plus retry on transient errors
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    )
+    
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_samsara_stats(api_token):
     """Fetches vehicle statistics from Samsara API"""
-    try:
-        url = f"{SAMSARA_BASE_URL}/fleet/vehicles/stats"
-        headers = {
-            'Authorization': f'Bearer {SAMSARA_API_TOKEN}',
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
-        params = {
-            'types': 'obdOdometerMeters,gpsDistanceMeters',
-            'limit': 100
-        }
+    url = f"{SAMSARA_BASE_URL}/fleet/vehicles/stats"
+    headers = {
+        'Authorization': f'Bearer {api_token}',
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+    params = {
+        'types': 'obdOdometerMeters,gpsDistanceMeters',
+        'limit': SAMSARA_PAGE_LIMIT
+    }
+    
+    vehicles = []
+    
+    # Follow pagination cursors; each page needs the previous endCursor,
+    # so pages are fetched in order over the shared keep-alive session
+    session = get_session()
+    while True:
+        response = session.get(url, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
         
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        data = response.json()
+        vehicles.extend(data.get('data', []))
         
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('data', [])
-        else:
-            st.error(f"Samsara API Error: {response.status_code}")
-            return []
-            
-    except Exception as e:
-        st.error(f"Error fetching Samsara data: {e}")
-        return []
+        pagination = data.get('pagination', {})
+        if not pagination.get('hasNextPage') or not pagination.get('endCursor'):
+            break
+        params['after'] = pagination['endCursor']
+    
+    return vehicles
+
+@st.cache_data(ttl=EXCEL_LAYER_TTL, show_spinner=False)
+def get_excel_data(excel_url):
+    """Loads data from Excel spreadsheet (cached for under half an hour)"""
+    # Reuse the on-disk snapshot while it is fresh, e.g. after a restart
+    cache_path = get_excel_cache_path(excel_url)
+    snapshot = read_excel_snapshot(cache_path)
+    if snapshot is not None:
+        return snapshot
+    
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    response = get_session().get(excel_url, headers=headers, timeout=10)
+    response.raise_for_status()
+    
+    # Arrow-backed dtypes: contiguous string buffers and nullable integers
+    df = pd.read_csv(io.BytesIO(response.content), dtype_backend='pyarrow')
+    df = clean_excel_data(df)
+    
+    if not df.empty:
+        write_excel_snapshot(df, cache_path)
+    
+    return df
+
+def get_excel_cache_path(excel_url):
+    """Returns the snapshot path for a sheet, keyed by its export URL"""
+    sheet_key = hashlib.sha256(excel_url.encode()).hexdigest()[:16]
+    return os.path.join(EXCEL_CACHE_DIR, f'excel_{sheet_key}.parquet')
 
-def get_excel_data():
-    """Loads data from Excel spreadsheet"""
+def read_excel_snapshot(path):
+    """Returns the on-disk Excel snapshot if it is fresh and valid, otherwise None"""
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(EXCEL_URL, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            df = pd.read_csv(io.StringIO(response.text))
-            return clean_excel_data(df)
-        else:
-            st.error(f"Excel loading error: {response.status_code}")
-            return pd.DataFrame()
-            
+        if os.path.getmtime(path) <= time.time() - EXCEL_LAYER_TTL:
+            return None
+        snapshot = pd.read_parquet(path)
+    except (OSError, ValueError):
+        return None  # Missing or unreadable snapshots fall back to the network
+    
+    # Only trust files holding the canonical columns written by clean_excel_data
+    known_columns = set(EXCEL_FIELDS) | {'VIN'}
+    if not all(isinstance(col, str) and (col in known_columns or col.startswith('Truck_ID')) for col in snapshot.columns):
+        return None
+    if not excel_key_columns(snapshot):
+        return None
+    
+    # Parquet round trips plain string columns back as string[python]
+    return cast_excel_keys(snapshot)
+
+def write_excel_snapshot(df, path):
+    """Writes the Excel snapshot atomically, so readers never see a partial file"""
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        df.to_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+    except (OSError, ValueError, TypeError):
+        # The snapshot is only an optimization
+        if tmp_path:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+@st.cache_data(ttl=FLEET_CACHE_TTL, show_spinner=False)
+def load_fleet_data(api_token, excel_url):
+    """Loads both sources, combines and summarizes them (cached for 5 minutes)"""
+    # Keyed on two strings: hashing the payloads on every rerun would cost
+    # more than combining them again
+    samsara_data, excel_df, errors = load_fleet_sources(api_token, excel_url)
+    combined_df = process_combined_data(samsara_data, excel_df)
+    
+    return {
+        'errors': errors,
+        'samsara_loaded': bool(samsara_data),
+        'excel_loaded': not excel_df.empty,
+        'combined_df': combined_df,
+        'metrics': create_metrics_summary(combined_df) if not combined_df.empty else None
+    }
+
+def load_fleet_sources(api_token, excel_url):
+    """Loads Samsara and Excel data in parallel, collecting error messages"""
+    # Both sources are independent hosts, so fetch them concurrently;
+    # errors are returned because st.* calls need the script thread
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        samsara_future = executor.submit(get_samsara_stats, api_token)
+        excel_future = executor.submit(get_excel_data, excel_url)
+    
+    errors = []
+    
+    try:
+        samsara_data = samsara_future.result()
     except Exception as e:
-        st.error(f"Excel error: {e}")
-        return pd.DataFrame()
+        errors.append(f"Error fetching Samsara data: {e}")
+        samsara_data = []
+    
+    try:
+        excel_df = excel_future.result()
+    except Exception as e:
+        errors.append(f"Excel error: {e}")
+        excel_df = pd.DataFrame()
+    
+    return samsara_data, excel_df, errors
+
+def clear_data_cache():
+    """Drops cached source data for all sessions so the next load hits the network"""
+    load_fleet_data.clear()
+    get_excel_data.clear()
+    
+    # Another session may have removed it already
+    with contextlib.suppress(OSError):
+        os.remove(get_excel_cache_path(EXCEL_URL))
 
 def clean_excel_data(df):
-    """Cleans Excel data by removing unwanted entries"""
+    """Cleans Excel data and renames the used columns to canonical names"""
     if df.empty:
         return df
     
@@ -83,12 +239,10 @@ def clean_excel_data(df):
     if df.columns[0].startswith('Unnamed'):
         df = df.iloc[:, 1:]
     
-    # Remove junk entries
-    filters_to_remove = ['OLD', 'DKD', 'GNS', 'SOLD']
+    # Remove junk entries in a single pass; the column may be read as
+    # numbers or nulls, so compare it as strings
     first_col = df.columns[0]
-    
-    for filter_val in filters_to_remove:
-        df = df[df[first_col] != filter_val]
+    df = df[~df[first_col].astype('string').isin(EXCEL_JUNK_ENTRIES)]
     
     # Trim columns after VIN
     vin_index = None
@@ -100,194 +254,194 @@ def clean_excel_data(df):
     if vin_index is not None:
         df = df.iloc[:, :vin_index + 1]
     
-    return df
-
-def process_combined_data(samsara_data, excel_df):
-    """Combines Samsara and Excel data, shows only matches"""
-    if not samsara_data or excel_df.empty:
-        return pd.DataFrame()
-    
-    combined_data = []
+    # Keep only the used columns, under fixed names, so nothing downstream
+    # has to search column labels again
+    columns = map_excel_columns(df)
+    df = pd.DataFrame({name: df[col] for name, col in columns.items()})
     
-    for vehicle in samsara_data:
-        # Samsara data
-        vehicle_id = vehicle.get('id', '')
-        vehicle_name = vehicle.get('name', '')
-        
-        # VIN from Samsara
-        samsara_vin = vehicle.get('externalIds', {}).get('samsara.vin', '')
-        serial = vehicle.get('externalIds', {}).get('samsara.serial', '')
-        
-        # Mileage from Samsara
-        obd_data = vehicle.get('obdOdometerMeters', {})
-        obd_miles = round((obd_data.get('value', 0) / 1609.34), 0) if obd_data.get('value') else 0
-        obd_time = obd_data.get('time', '') if obd_data else ''
-        
-        gps_data = vehicle.get('gpsDistanceMeters', {})
-        gps_miles = round((gps_data.get('value', 0) / 1609.34), 0) if gps_data.get('value') else 0
-        gps_time = gps_data.get('time', '') if gps_data else ''
-        
-        # Find match in Excel by ID or VIN
-        excel_match = find_excel_match(vehicle_name, samsara_vin, excel_df)
-        
-        # Add to list ONLY if there's a match in Excel
-        if excel_match is not None:
-            # Extract data from Excel
-            excel_data = extract_excel_data(excel_match, excel_df)
-            
-            # Calculate days until inspections
-            annual_days = calculate_days_remaining(excel_data.get('annual_date'))
-            pm_days = calculate_days_remaining(excel_data.get('pm_date'))
-            pm_insp_days = calculate_days_remaining(excel_data.get('pm_insp_date'))
-            
-            combined_info = {
-                'Vehicle_ID': vehicle_id,
-                'Vehicle_Name': vehicle_name,
-                'VIN': samsara_vin,
-                'Serial': serial,
-                'OBD_Odometer_Miles': int(obd_miles),
-                'GPS_Distance_Miles': int(gps_miles),
-                'OBD_Last_Update': obd_time,
-                'GPS_Last_Update': gps_time,
-                'Status': excel_data.get('status', ''),
-                'Annual_Date': excel_data.get('annual_date', ''),
-                'Annual_Days_Remaining': annual_days,
-                'PM_Date': excel_data.get('pm_date', ''),
-                'PM_Days_Remaining': pm_days,
-                'PM_Insp_Date': excel_data.get('pm_insp_date', ''),
-                'PM_Insp_Days_Remaining': pm_insp_days,
-                'Annual_Alert': get_alert_status(annual_days),
-                'PM_Alert': get_alert_status(pm_days),
-                'PM_Insp_Alert': get_alert_status(pm_insp_days)
-            }
-            combined_data.append(combined_info)
-    
-    return pd.DataFrame(combined_data)
-
-def find_excel_match(vehicle_name, samsara_vin, excel_df):
-    """Finds match in Excel by ID or VIN"""
-    # First search by vehicle name (ID)
-    for col in excel_df.columns:
-        if 'TRUCK' in str(col).upper() or 'ID' in str(col).upper():
-            matches = excel_df[excel_df[col].astype(str) == str(vehicle_name)]
-            if not matches.empty:
-                return matches.index[0]
-    
-    # If not found, search by VIN
-    if samsara_vin:
-        for col in excel_df.columns:
-            if 'VIN' in str(col).upper():
-                matches = excel_df[excel_df[col].astype(str) == str(samsara_vin)]
-                if not matches.empty:
-                    return matches.index[0]
-    
-    return None
-
-def extract_excel_data(row_index, excel_df):
-    """Extracts data from Excel row"""
-    row = excel_df.iloc[row_index]
-    
-    excel_data = {
-        'status': '',
-        'annual_date': '',
-        'pm_date': '',
-        'pm_insp_date': ''
-    }
+    return cast_excel_keys(df)
+
+def cast_excel_keys(df):
+    """Converts the Excel match keys to Arrow strings"""
+    # Match keys are compared as strings; convert them once per load
+    for key_col, _ in excel_key_columns(df):
+        df[key_col] = df[key_col].astype('string[pyarrow]')
     
-    # Find relevant columns
-    for col in excel_df.columns:
+    return df
+
+def map_excel_columns(df):
+    """Maps canonical column names to Excel column labels in a single pass"""
+    columns = {}
+    name_keys = 0
+    for col in df.columns:
         col_upper = str(col).upper()
         
+        # Every TRUCK/ID column is a name key candidate, tried in sheet order
+        if 'TRUCK' in col_upper or 'ID' in col_upper:
+            name_keys += 1
+            columns['Truck_ID' if name_keys == 1 else f'Truck_ID_{name_keys}'] = col
+        if 'VIN' not in columns and 'VIN' in col_upper:
+            columns['VIN'] = col
+        
         if 'STATUS' in col_upper:
-            excel_data['status'] = str(row[col]) if pd.notna(row[col]) else ''
+            columns['Status'] = col
         elif 'ANNUAL' in col_upper:
-            excel_data['annual_date'] = str(row[col]) if pd.notna(row[col]) else ''
+            columns['Annual_Date'] = col
         elif 'PM' in col_upper and 'DATE' in col_upper:
-            excel_data['pm_date'] = str(row[col]) if pd.notna(row[col]) else ''
+            columns['PM_Date'] = col
         elif 'PM' in col_upper and 'INSP' in col_upper:
-            excel_data['pm_insp_date'] = str(row[col]) if pd.notna(row[col]) else ''
+            columns['PM_Insp_Date'] = col
     
-    return excel_data
+    return columns
 
-def calculate_days_remaining(date_value):
-    """Calculates days until date"""
-    if not date_value or date_value == '' or pd.isna(date_value):
-        return None
+def excel_key_columns(excel_df):
+    """Lists (Excel key column, vehicle column) pairs in match order"""
+    name_keys = [(col, 'Vehicle_Name') for col in excel_df.columns if col.startswith('Truck_ID')]
+    vin_keys = [('VIN', 'VIN')] if 'VIN' in excel_df else []
+    return name_keys + vin_keys
+
+def process_combined_data(samsara_data, excel_df):
+    """Combines Samsara and Excel data, shows only matches"""
+    if not samsara_data or excel_df.empty:
+        return pd.DataFrame()
     
-    try:
-        date_formats = ['%m/%d/%Y', '%Y-%m-%d', '%d.%m.%Y', '%m-%d-%Y']
-        
-        for fmt in date_formats:
-            try:
-                target_date = datetime.strptime(str(date_value), fmt)
-                today = datetime.now()
-                return (target_date - today).days
-            except ValueError:
-                continue
-        
-        return None
-    except:
-        return None
+    # Flatten Samsara records into columns in one pass
+    samsara_df = pd.json_normalize(samsara_data).reindex(columns=SAMSARA_FIELDS)
+    
+    vehicles = pd.DataFrame({
+        'Vehicle_ID': samsara_df['id'].fillna(''),
+        'Vehicle_Name': samsara_df['name'].fillna(''),
+        'VIN': samsara_df['externalIds.samsara.vin'].fillna(''),
+        'Serial': samsara_df['externalIds.samsara.serial'].fillna(''),
+        'OBD_Odometer_Miles': (samsara_df['obdOdometerMeters.value'].fillna(0) / 1609.34).round().astype(int),
+        'GPS_Distance_Miles': (samsara_df['gpsDistanceMeters.value'].fillna(0) / 1609.34).round().astype(int),
+        'OBD_Last_Update': samsara_df['obdOdometerMeters.time'].fillna(''),
+        'GPS_Last_Update': samsara_df['gpsDistanceMeters.time'].fillna('')
+    })
+    
+    excel_fields = pd.DataFrame(index=excel_df.index)
+    for field in EXCEL_FIELDS:
+        if field in excel_df:
+            values = excel_df[field]
+            excel_fields[field] = values.astype(str).where(values.notna(), '')
+        else:
+            excel_fields[field] = ''
+    
+    # Match by vehicle name (ID) first, then by VIN for the rest; each pass
+    # maps vehicle keys to Excel row positions through a key-indexed Series
+    match_position = pd.Series(np.nan, index=vehicles.index)
+    
+    for key_col, vehicle_col in excel_key_columns(excel_df):
+        keys = excel_df[key_col]
+        first_rows = (keys.notna() & ~keys.duplicated()).to_numpy()
+        lookup = pd.Series(np.arange(len(keys))[first_rows], index=keys[first_rows].to_numpy())
+        vehicle_keys = vehicles[vehicle_col].where(vehicles[vehicle_col] != '')
+        match_position = match_position.fillna(vehicle_keys.map(lookup))
+    
+    matched = match_position.notna()
+    if not matched.any():
+        return pd.DataFrame()
+    
+    combined = pd.concat([
+        vehicles[matched].reset_index(drop=True),
+        excel_fields.iloc[match_position[matched].astype(int)].reset_index(drop=True)
+    ], axis=1)
+    
+    # Calculate days until inspections
+    combined['Annual_Days_Remaining'] = calculate_days_remaining(combined['Annual_Date'])
+    combined['PM_Days_Remaining'] = calculate_days_remaining(combined['PM_Date'])
+    combined['PM_Insp_Days_Remaining'] = calculate_days_remaining(combined['PM_Insp_Date'])
+    
+    combined['Annual_Alert'] = get_alert_status(combined['Annual_Days_Remaining'])
+    combined['PM_Alert'] = get_alert_status(combined['PM_Days_Remaining'])
+    combined['PM_Insp_Alert'] = get_alert_status(combined['PM_Insp_Days_Remaining'])
+    
+    # Compact dtypes shrink the Arrow payload st.dataframe sends to the browser
+    return combined[COMBINED_COLUMNS].astype({
+        'Vehicle_ID': 'string[pyarrow]',
+        'Vehicle_Name': 'string[pyarrow]',
+        'VIN': 'string[pyarrow]',
+        'Serial': 'string[pyarrow]',
+        'OBD_Odometer_Miles': 'int32',
+        'GPS_Distance_Miles': 'int32',
+        'Annual_Days_Remaining': 'Int32',
+        'PM_Days_Remaining': 'Int32',
+        'PM_Insp_Days_Remaining': 'Int32',
+        'Status': 'category'
+    })
+
+def calculate_days_remaining(dates):
+    """Calculates days until each date in a column"""
+    # Parse the whole column per format; earlier formats take precedence
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    for fmt in DATE_FORMATS:
+        parsed = parsed.fillna(pd.to_datetime(dates, format=fmt, errors='coerce'))
+    
+    return (parsed - pd.Timestamp.now()).dt.days
 
 def get_alert_status(days_remaining):
-    """Determines alert status"""
-    if days_remaining is None:
-        return "No Data"
-    elif days_remaining < 0:
-        return "OVERDUE"
-    elif days_remaining <= 30:
-        return "CRITICAL"
-    elif days_remaining <= 60:
-        return "WARNING"
-    else:
-        return "OK"
+    """Determines alert status for a column of days remaining"""
+    conditions = [
+        days_remaining.isna(),
+        days_remaining < 0,
+        days_remaining <= 30,
+        days_remaining <= 60
+    ]
+    choices = ['No Data', 'OVERDUE', 'CRITICAL', 'WARNING']
+    return pd.Categorical(np.select(conditions, choices, default='OK'), categories=ALERT_LEVELS, ordered=True)
+
+def get_overview_data(df):
+    """Aggregates the compliance and mileage values behind the overview chart"""
+    # 1. Compliance pie chart
+    fully_compliant = (df['Annual_Alert'] == 'OK') & (df['PM_Alert'] == 'OK')
+    needs_attention = df['Annual_Alert'].isin(['OVERDUE', 'CRITICAL']) | df['PM_Alert'].isin(['OVERDUE', 'CRITICAL'])
+    compliance_labels = np.select(
+        [fully_compliant, needs_attention],
+        ['Fully Compliant', 'Needs Attention'],
+        default='Warning Status'
+    )
+    
+    compliance_series = pd.Series(compliance_labels).value_counts()
+    
+    # 2. Mileage vs Alert Status
+    alert_categories = ['OK', 'WARNING', 'CRITICAL', 'OVERDUE']
+    mileage_by_alert = (
+        df.groupby('Annual_Alert', observed=True)['OBD_Odometer_Miles'].mean()
+        .reindex(alert_categories, fill_value=0)
+        .tolist()
+    )
+    
+    return {
+        'pie_labels': compliance_series.index.tolist(),
+        'pie_values': compliance_series.tolist(),
+        'bar_x': alert_categories,
+        'bar_y': mileage_by_alert
+    }
 
 def create_simple_overview_chart(df):
     """Creates a simple overview chart for faster loading"""
+    overview = get_overview_data(df)
     fig = make_subplots(
         rows=1, cols=2,
         subplot_titles=['Compliance Status', 'Fleet Health Metrics'],
         specs=[[{'type':'domain'}, {'type':'xy'}]]
     )
     
-    # 1. Compliance pie chart
-    compliance_counts = []
-    for _, row in df.iterrows():
-        if row['Annual_Alert'] == 'OK' and row['PM_Alert'] == 'OK':
-            compliance_counts.append('Fully Compliant')
-        elif row['Annual_Alert'] in ['OVERDUE', 'CRITICAL'] or row['PM_Alert'] in ['OVERDUE', 'CRITICAL']:
-            compliance_counts.append('Needs Attention')
-        else:
-            compliance_counts.append('Warning Status')
-    
-    compliance_series = pd.Series(compliance_counts).value_counts()
     colors = {'Fully Compliant': '#27ae60', 'Warning Status': '#f39c12', 'Needs Attention': '#e74c3c'}
     
     fig.add_trace(go.Pie(
-        labels=compliance_series.index,
-        values=compliance_series.values,
-        marker_colors=[colors.get(x, '#95a5a6') for x in compliance_series.index],
+        labels=overview['pie_labels'],
+        values=overview['pie_values'],
+        marker_colors=[colors.get(x, '#95a5a6') for x in overview['pie_labels']],
         hole=0.4,
         textinfo='label+percent+value'
     ), 1, 1)
     
-    # 2. Mileage vs Alert Status
-    alert_categories = ['OK', 'WARNING', 'CRITICAL', 'OVERDUE']
-    mileage_by_alert = []
-    
-    for alert in alert_categories:
-        alert_data = df[df['Annual_Alert'] == alert]
-        if not alert_data.empty:
-            avg_mileage = alert_data['OBD_Odometer_Miles'].mean()
-            mileage_by_alert.append(avg_mileage)
-        else:
-            mileage_by_alert.append(0)
-    
     fig.add_trace(go.Bar(
-        x=alert_categories,
-        y=mileage_by_alert,
+        x=overview['bar_x'],
+        y=overview['bar_y'],
         marker_color=['#27ae60', '#f39c12', '#e74c3c', '#8e44ad'],
-        text=[f'{miles:,.0f}' for miles in mileage_by_alert],
+        text=[f'{miles:,.0f}' for miles in overview['bar_y']],
         textposition='auto'
     ), 1, 2)
     
@@ -307,22 +461,24 @@ def create_metrics_summary(df):
     """Creates summary metrics for the fleet"""
     total_vehicles = len(df)
     
-    # Compliance metrics
-    annual_ok = len(df[df['Annual_Alert'] == 'OK'])
-    annual_overdue = len(df[df['Annual_Alert'] == 'OVERDUE'])
-    annual_critical = len(df[df['Annual_Alert'] == 'CRITICAL'])
+    # Compliance metrics, one counting pass per alert column
+    annual_counts = df['Annual_Alert'].value_counts()
+    annual_ok = annual_counts.get('OK', 0)
+    annual_overdue = annual_counts.get('OVERDUE', 0)
+    annual_critical = annual_counts.get('CRITICAL', 0)
     
-    pm_ok = len(df[df['PM_Alert'] == 'OK'])
-    pm_overdue = len(df[df['PM_Alert'] == 'OVERDUE'])
-    pm_critical = len(df[df['PM_Alert'] == 'CRITICAL'])
+    pm_counts = df['PM_Alert'].value_counts()
+    pm_ok = pm_counts.get('OK', 0)
+    pm_overdue = pm_counts.get('OVERDUE', 0)
+    pm_critical = pm_counts.get('CRITICAL', 0)
     
     # Mileage metrics
     avg_mileage = df['OBD_Odometer_Miles'].mean()
     max_mileage = df['OBD_Odometer_Miles'].max()
-    high_mileage_count = len(df[df['OBD_Odometer_Miles'] > 400000])
+    high_mileage_count = (df['OBD_Odometer_Miles'] > 400000).sum()
     
     # Fleet health score
-    fully_compliant = len(df[(df['Annual_Alert'] == 'OK') & (df['PM_Alert'] == 'OK')])
+    fully_compliant = ((df['Annual_Alert'] == 'OK') & (df['PM_Alert'] == 'OK')).sum()
     fleet_health = (fully_compliant / total_vehicles) * 100 if total_vehicles > 0 else 0
     
     return {
@@ -339,6 +495,121 @@ def create_metrics_summary(df):
         'fleet_health': fleet_health
     }
 
+def render_metrics(metrics):
+    """Renders the key fleet metrics row"""
+    st.header("📊 Fleet Overview")
+    col1, col2, col3, col4, col5 = st.columns(5)
+    
+    with col1:
+        st.metric("🚛 Total Fleet", metrics['total_vehicles'])
+    with col2:
+        st.metric("💚 Fleet Health", f"{metrics['fleet_health']:.1f}%",
+                delta=f"{metrics['fleet_health'] - 85:.1f}%" if metrics['fleet_health'] >= 85 else f"{metrics['fleet_health'] - 85:.1f}%")
+    with col3:
+        st.metric("📅 Annual Compliant", f"{metrics['annual_ok']}/{metrics['total_vehicles']}",
+                delta=f"-{metrics['annual_overdue']} overdue")
+    with col4:
+        st.metric("🔧 PM Compliant", f"{metrics['pm_ok']}/{metrics['total_vehicles']}",
+                delta=f"-{metrics['pm_overdue']} overdue")
+    with col5:
+        st.metric("📈 Avg Mileage", f"{metrics['avg_mileage']:,.0f} mi",
+                delta=f"Max: {metrics['max_mileage']:,.0f}")
+
+def render_alerts(combined_df):
+    """Renders vehicles that need immediate attention"""
+    st.header("🚨 Vehicles Requiring Immediate Attention")
+    
+    # Priority masks, computed once; a vehicle can be in both groups
+    is_overdue = (combined_df['Annual_Alert'] == 'OVERDUE') | (combined_df['PM_Alert'] == 'OVERDUE')
+    is_critical = (combined_df['Annual_Alert'] == 'CRITICAL') | (combined_df['PM_Alert'] == 'CRITICAL')
+    critical_count = (is_overdue | is_critical).sum()
+    
+    if critical_count:
+        st.error(f"⚠️ {critical_count} vehicles require immediate attention")
+        
+        # Group by priority
+        overdue = combined_df[is_overdue]
+        critical = combined_df[is_critical]
+        
+        if not overdue.empty:
+            st.subheader("🔴 OVERDUE Maintenance")
+            st.dataframe(
+                overdue[['Vehicle_Name', 'OBD_Odometer_Miles', 'Annual_Alert', 'PM_Alert', 'Annual_Days_Remaining', 'PM_Days_Remaining']],
+                use_container_width=True
+            )
+        
+        if not critical.empty:
+            st.subheader("🟡 CRITICAL (Due Soon)")
+            st.dataframe(
+                critical[['Vehicle_Name', 'OBD_Odometer_Miles', 'Annual_Alert', 'PM_Alert', 'Annual_Days_Remaining', 'PM_Days_Remaining']],
+                use_container_width=True
+            )
+    else:
+        st.success("✅ No vehicles require immediate attention!")
+    
+    # High mileage vehicles
+    high_mileage = combined_df[combined_df['OBD_Odometer_Miles'] > 400000]
+    if not high_mileage.empty:
+        st.subheader(f"📊 High Mileage Vehicles ({len(high_mileage)} vehicles >400K miles)")
+        st.dataframe(
+            high_mileage[['Vehicle_Name', 'OBD_Odometer_Miles', 'Annual_Alert', 'PM_Alert']].sort_values('OBD_Odometer_Miles', ascending=False),
+            use_container_width=True
+        )
+
+@st.fragment
+def render_fleet_table(combined_df):
+    """Renders the filterable fleet table; filter changes rerun only this fragment"""
+    st.header("📋 Complete Fleet Data")
+    
+    # Filters
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        annual_filter = st.selectbox("Annual Status:", 
+                                   ['All'] + list(combined_df['Annual_Alert'].unique().sort_values()))
+    with col2:
+        pm_filter = st.selectbox("PM Status:", 
+                                ['All'] + list(combined_df['PM_Alert'].unique().sort_values()))
+    with col3:
+        vehicle_search = st.text_input("Search Vehicles:", placeholder="Enter vehicle number")
+    
+    # Apply filters
+    filtered_df = combined_df.copy()
+    
+    if annual_filter != 'All':
+        filtered_df = filtered_df[filtered_df['Annual_Alert'] == annual_filter]
+    if pm_filter != 'All':
+        filtered_df = filtered_df[filtered_df['PM_Alert'] == pm_filter]
+    if vehicle_search:
+        filtered_df = filtered_df[filtered_df['Vehicle_Name'].str.contains(vehicle_search, case=False, na=False)]
+    
+    st.info(f"Showing {len(filtered_df)} of {len(combined_df)} vehicles")
+    
+    # Display filtered data
+    st.dataframe(filtered_df, use_container_width=True, height=500)
+    
+    # Export button
+    if st.button("📊 Export to CSV", use_container_width=True):
+        csv_file = filtered_df.to_csv(index=False)
+        st.download_button(
+            label="Download CSV",
+            data=csv_file,
+            file_name=f"fleet_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv"
+        )
+
+@st.fragment(run_every=1)
+def render_refresh_countdown(refresh_interval):
+    """Ticks the refresh countdown; only this fragment reruns each second"""
+    time_elapsed = (datetime.now() - st.session_state.last_update).total_seconds()
+    time_remaining = max(0, refresh_interval - time_elapsed)
+    
+    st.info(f"Next refresh in: {time_remaining:.0f}s")
+    
+    # Rerun the whole app once the interval is up so main() reloads the data
+    if time_remaining == 0:
+        st.rerun()
+
 def main():
     st.title("🚛 Fleet Management Dashboard - Auto-Loading")
     
@@ -365,196 +636,81 @@ def main():
     auto_refresh = st.sidebar.checkbox("Auto-refresh data", value=False)
     refresh_interval = st.sidebar.selectbox("Refresh interval (seconds):", [30, 60, 300, 900], index=1)
     
-    # Initialize session state for data caching
-    if 'fleet_data_loaded' not in st.session_state:
-        st.session_state.fleet_data_loaded = False
-        st.session_state.combined_df = None
-        st.session_state.metrics = None
+    # Data itself is memoized by st.cache_data; only the load time is per session
+    if 'last_update' not in st.session_state:
         st.session_state.last_update = None
     
     # Auto-refresh logic
     if auto_refresh and st.session_state.last_update:
         time_since_update = (datetime.now() - st.session_state.last_update).total_seconds()
         if time_since_update > refresh_interval:
-            st.session_state.fleet_data_loaded = False
+            clear_data_cache()
+            st.session_state.last_update = None
     
     # Manual refresh button
     col1, col2 = st.columns([3, 1])
     with col1:
-        if st.session_state.fleet_data_loaded:
-            st.success("✅ Fleet data loaded and ready")
-        else:
-            st.info("🔄 Loading fleet data...")
+        status_placeholder = st.empty()
+        status_placeholder.info("🔄 Loading fleet data...")
     with col2:
         if st.button("🔄 Refresh Data", use_container_width=True):
-            st.session_state.fleet_data_loaded = False
-            st.session_state.combined_df = None
-            st.session_state.metrics = None
-            st.rerun()
-    
-    # Load data automatically or use cached data
-    if not st.session_state.fleet_data_loaded:
-        with st.spinner("🔄 Fetching data from Samsara and Excel..."):
-            # Load data from sources
-            samsara_data = get_samsara_stats()
-            excel_df = get_excel_data()
-            
-            if samsara_data and not excel_df.empty:
-                # Combine and process data
-                combined_df = process_combined_data(samsara_data, excel_df)
-                
-                if not combined_df.empty:
-                    # Cache the data in session state
-                    st.session_state.combined_df = combined_df
-                    st.session_state.metrics = create_metrics_summary(combined_df)
-                    st.session_state.fleet_data_loaded = True
-                    st.session_state.last_update = datetime.now()
-                    
-                    st.success(f"✅ Successfully loaded {len(combined_df)} vehicles with complete data")
-                else:
-                    st.warning("⚠️ No matching vehicles found between Samsara and Excel data")
-                    st.info("Please check that vehicle IDs or VINs match between both systems")
-                    return
-            else:
-                st.error("❌ Failed to load data from one or more sources")
-                if not samsara_data:
-                    st.error("- Samsara API connection failed")
-                if excel_df.empty:
-                    st.error("- Excel data loading failed")
-                return
-    
-    # Use cached data if available
-    if st.session_state.fleet_data_loaded and st.session_state.combined_df is not None:
-        combined_df = st.session_state.combined_df
-        metrics = st.session_state.metrics
-        
-        # Display key metrics
-        st.header("📊 Fleet Overview")
-        col1, col2, col3, col4, col5 = st.columns(5)
-        
-        with col1:
-            st.metric("🚛 Total Fleet", metrics['total_vehicles'])
-        with col2:
-            st.metric("💚 Fleet Health", f"{metrics['fleet_health']:.1f}%",
-                    delta=f"{metrics['fleet_health'] - 85:.1f}%" if metrics['fleet_health'] >= 85 else f"{metrics['fleet_health'] - 85:.1f}%")
-        with col3:
-            st.metric("📅 Annual Compliant", f"{metrics['annual_ok']}/{metrics['total_vehicles']}",
-                    delta=f"-{metrics['annual_overdue']} overdue")
-        with col4:
-            st.metric("🔧 PM Compliant", f"{metrics['pm_ok']}/{metrics['total_vehicles']}",
-                    delta=f"-{metrics['pm_overdue']} overdue")
-        with col5:
-            st.metric("📈 Avg Mileage", f"{metrics['avg_mileage']:,.0f} mi",
-                    delta=f"Max: {metrics['max_mileage']:,.0f}")
-        
-        # Quick overview chart
-        st.plotly_chart(create_simple_overview_chart(combined_df), use_container_width=True)
+            clear_data_cache()
+            st.session_state.last_update = None
+    
+    # Load and combine data; cache hits return immediately
+    with st.spinner("🔄 Fetching data from Samsara and Excel..."):
+        fleet = load_fleet_data(SAMSARA_API_TOKEN, EXCEL_URL)
         
-        # Create simplified tabs
-        tab1, tab2 = st.tabs(["🚨 Critical Alerts", "📋 Fleet Data"])
+        for error in fleet['errors']:
+            st.error(error)
         
-        with tab1:
-            st.header("🚨 Vehicles Requiring Immediate Attention")
+        if not fleet['samsara_loaded'] or not fleet['excel_loaded']:
+            # Don't keep a failed load; the next run retries the sources
+            load_fleet_data.clear(SAMSARA_API_TOKEN, EXCEL_URL)
             
-            # Critical vehicles
-            critical_vehicles = combined_df[
-                (combined_df['Annual_Alert'].isin(['OVERDUE', 'CRITICAL'])) |
-                (combined_df['PM_Alert'].isin(['OVERDUE', 'CRITICAL']))
-            ]
-            
-            if not critical_vehicles.empty:
-                st.error(f"⚠️ {len(critical_vehicles)} vehicles require immediate attention")
-                
-                # Group by priority
-                overdue = critical_vehicles[
-                    (critical_vehicles['Annual_Alert'] == 'OVERDUE') |
-                    (critical_vehicles['PM_Alert'] == 'OVERDUE')
-                ]
-                
-                critical = critical_vehicles[
-                    (critical_vehicles['Annual_Alert'] == 'CRITICAL') |
-                    (critical_vehicles['PM_Alert'] == 'CRITICAL')
-                ]
-                
-                if not overdue.empty:
-                    st.subheader("🔴 OVERDUE Maintenance")
-                    st.dataframe(
-                        overdue[['Vehicle_Name', 'OBD_Odometer_Miles', 'Annual_Alert', 'PM_Alert', 'Annual_Days_Remaining', 'PM_Days_Remaining']],
-                        use_container_width=True
-                    )
-                
-                if not critical.empty:
-                    st.subheader("🟡 CRITICAL (Due Soon)")
-                    st.dataframe(
-                        critical[['Vehicle_Name', 'OBD_Odometer_Miles', 'Annual_Alert', 'PM_Alert', 'Annual_Days_Remaining', 'PM_Days_Remaining']],
-                        use_container_width=True
-                    )
-            else:
-                st.success("✅ No vehicles require immediate attention!")
-            
-            # High mileage vehicles
-            high_mileage = combined_df[combined_df['OBD_Odometer_Miles'] > 400000]
-            if not high_mileage.empty:
-                st.subheader(f"📊 High Mileage Vehicles ({len(high_mileage)} vehicles >400K miles)")
-                st.dataframe(
-                    high_mileage[['Vehicle_Name', 'OBD_Odometer_Miles', 'Annual_Alert', 'PM_Alert']].sort_values('OBD_Odometer_Miles', ascending=False),
-                    use_container_width=True
-                )
+            st.error("❌ Failed to load data from one or more sources")
+            if not fleet['samsara_loaded']:
+                st.error("- Samsara API connection failed")
+            if not fleet['excel_loaded']:
+                st.error("- Excel data loading failed")
+            return
         
-        with tab2:
-            st.header("📋 Complete Fleet Data")
-            
-            # Filters
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                annual_filter = st.selectbox("Annual Status:", 
-                                           ['All'] + list(combined_df['Annual_Alert'].unique()))
-            with col2:
-                pm_filter = st.selectbox("PM Status:", 
-                                        ['All'] + list(combined_df['PM_Alert'].unique()))
-            with col3:
-                vehicle_search = st.text_input("Search Vehicles:", placeholder="Enter vehicle number")
-            
-            # Apply filters
-            filtered_df = combined_df.copy()
-            
-            if annual_filter != 'All':
-                filtered_df = filtered_df[filtered_df['Annual_Alert'] == annual_filter]
-            if pm_filter != 'All':
-                filtered_df = filtered_df[filtered_df['PM_Alert'] == pm_filter]
-            if vehicle_search:
-                filtered_df = filtered_df[filtered_df['Vehicle_Name'].str.contains(vehicle_search, case=False, na=False)]
-            
-            st.info(f"Showing {len(filtered_df)} of {len(combined_df)} vehicles")
-            
-            # Display filtered data
-            st.dataframe(filtered_df, use_container_width=True, height=500)
-            
-            # Export button
-            if st.button("📊 Export to CSV", use_container_width=True):
-                csv_file = filtered_df.to_csv(index=False)
-                st.download_button(
-                    label="Download CSV",
-                    data=csv_file,
-                    file_name=f"fleet_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
-                )
+        combined_df = fleet['combined_df']
         
-        # Last update info
-        if st.session_state.last_update:
-            st.sidebar.info(f"Last updated: {st.session_state.last_update.strftime('%H:%M:%S')}")
+        if combined_df.empty:
+            st.warning("⚠️ No matching vehicles found between Samsara and Excel data")
+            st.info("Please check that vehicle IDs or VINs match between both systems")
+            return
         
-        # Auto-refresh countdown
-        if auto_refresh:
-            placeholder = st.sidebar.empty()
-            import time
-            time_remaining = refresh_interval
-            if st.session_state.last_update:
-                time_elapsed = (datetime.now() - st.session_state.last_update).total_seconds()
-                time_remaining = max(0, refresh_interval - time_elapsed)
-            
-            placeholder.info(f"Next refresh in: {time_remaining:.0f}s")
+        metrics = fleet['metrics']
+    
+    status_placeholder.success("✅ Fleet data loaded and ready")
+    if st.session_state.last_update is None:
+        st.session_state.last_update = datetime.now()
+        st.success(f"✅ Successfully loaded {len(combined_df)} vehicles with complete data")
+    
+    # Display key metrics
+    render_metrics(metrics)
+    
+    # Quick overview chart
+    st.plotly_chart(create_simple_overview_chart(combined_df), use_container_width=True)
+    
+    # Create simplified tabs
+    tab1, tab2 = st.tabs(["🚨 Critical Alerts", "📋 Fleet Data"])
+    
+    with tab1:
+        render_alerts(combined_df)
+    
+    with tab2:
+        render_fleet_table(combined_df)
+    
+    # Last update info
+    st.sidebar.info(f"Last updated: {st.session_state.last_update.strftime('%H:%M:%S')}")
+    
+    # Auto-refresh countdown
+    if auto_refresh:
+        with st.sidebar:
+            render_refresh_countdown(refresh_interval)
 
 if __name__ == "__main__":
     main()